@@ -1,16 +1,38 @@
+import csv
+import io
 import streamlit as st
-import pandas as pd
 from clean_cfi import extract_credible_fear_data, load_truth, sort_date_range_dict
 
 def update_truth_with_new_data(truth_data, new_data):
-    updated_data = truth_data.copy()
+    updated_data = {}
+    for date_range, values in truth_data.items():
+        if date_range in new_data:
+            values = {**values, **new_data[date_range]}
+        updated_data[date_range] = values
     for date_range, values in new_data.items():
-        if date_range in updated_data:
-            updated_data[date_range].update(values)
-        else:
+        if date_range not in truth_data:
             updated_data[date_range] = values
     return updated_data
 
+@st.cache_data(show_spinner=False)
+def load_gov_data(gov_bytes):
+    """Parse a government CFI file, memoized on its contents across reruns."""
+    return extract_credible_fear_data(io.BytesIO(gov_bytes))
+
+@st.cache_data(show_spinner=False)
+def load_truth_data(truth_bytes):
+    """Parse a CFI truth file, memoized on its contents across reruns."""
+    return load_truth(io.BytesIO(truth_bytes))
+
+def records_to_csv(records):
+    """Serialize a list of row dicts to CSV text, one column per distinct key."""
+    fieldnames = list(dict.fromkeys(key for record in records for key in record))
+    buf = io.StringIO()
+    writer = csv.DictWriter(buf, fieldnames=fieldnames, lineterminator='\n')
+    writer.writeheader()
+    writer.writerows(records)
+    return buf.getvalue()
+
 def main():
     st.title("CFI Data Update Tool")
 
@@ -30,8 +52,8 @@ def main():
 
     if gov_file and truth_file:
         # Process the uploaded files
-        new_data = extract_credible_fear_data(gov_file)
-        truth_data = load_truth(truth_file)
+        new_data = load_gov_data(gov_file.getvalue())
+        truth_data = load_truth_data(truth_file.getvalue())
 
         # Update truth data with new data
         updated_data = update_truth_with_new_data(truth_data, new_data)
@@ -39,19 +61,16 @@ def main():
         # Sort the updated data
         sorted_data = sort_date_range_dict(updated_data)
 
-        # Convert to DataFrame for display
-        df = pd.DataFrame.from_dict(sorted_data, orient='index')
-        df.reset_index(inplace=True)
-        df.columns = ['Date Range'] + list(df.columns[1:])
+        # Flatten to one record per date range for display and export
+        records = [{'Date Range': date_range, **values} for date_range, values in sorted_data.items()]
 
         st.subheader("Updated CFI Data")
-        st.dataframe(df)
+        st.dataframe(records)
 
         # Option to download updated data
-        csv = df.to_csv(index=False)
         st.download_button(
             label="Download updated CFI data as CSV",
-            data=csv,
+            data=records_to_csv(records),
             file_name="updated_cfi_data.csv",
             mime="text/csv",
         )
@@ -1,61 +1,136 @@
+import codecs
 import csv
 import io
-from datetime import datetime
-from collections import defaultdict
-from fuzzywuzzy import fuzz
+import re
+from datetime import date, datetime
+from functools import lru_cache
+from rapidfuzz import fuzz
 
-def sort_date_range_dict(data):
-    def get_start_date(date_range):
-        start_date_str = date_range.split('-')[:3]
-        return datetime.strptime('-'.join(start_date_str), '%Y-%m-%d')
+# Row labels of the government table that feed the cleaned output.
+CATEGORIES = frozenset(['Case Receipts', 'All Decisions', 'Fear Established_Persecution (Y)',
+                        'Fear Established_Torture (Y)', 'Fear Not Established (N)',
+                        'Administratively Closed'])
+
+# Columns of the cleaned output, in the order used by the truth file.
+OUTPUT_COLUMNS = ('Case Receipts', 'All Decisions', 'Fear Established (Y)',
+                  'Fear Not Established (N)', 'Closings')
+_format_count = "{:,}".format
+
+# Ranges zipped from the label and blank columns rather than real dates.
+_SKIP_DATE_RANGES = frozenset(('From-To', '-'))
+
+# "M/D/YYYY-M/D/YYYY" range as built by extract_date_ranges from the From/To rows.
+_REPORT_DATE_RANGE = re.compile(r'^\s*(\d{1,2}/\d{1,2}/\d{4})\s*-\s*(\d{1,2}/\d{1,2}/\d{4})\s*$')
 
-    sorted_dict = dict(sorted(data.items(), key=lambda x: get_start_date(x[0])))
-    return sorted_dict
+def parse_iso_date(date_str):
+    """Parse the YYYY-MM-DD date at the start of date_str.
+
+    Zero-padded dates are read by slicing; anything else (e.g. unpadded
+    dates in a hand-edited truth file) goes through strptime, which also
+    rejects malformed keys.
+    """
+    if (date_str[4:5] == '-' and date_str[7:8] == '-' and date_str[10:11] in ('', '-')
+            and date_str[0:4].isdecimal() and date_str[5:7].isdecimal()
+            and date_str[8:10].isdecimal()):
+        return date(int(date_str[0:4]), int(date_str[5:7]), int(date_str[8:10]))
+    return datetime.strptime('-'.join(date_str.split('-')[:3]), '%Y-%m-%d').date()
+
+def parse_report_date(date_str):
+    """Parse a government report M/D/YYYY string without going through strptime."""
+    month, day, year = date_str.strip().split('/')
+    return date(int(year), int(month), int(day))
+
+def sort_date_range_dict(data):
+    decorated = [(parse_iso_date(date_range), date_range, values)
+                 for date_range, values in data.items()]
+    decorated.sort(key=lambda item: item[0])
+    return {date_range: values for _, date_range, values in decorated}
 
 def is_table_header(row):
     """Check if the given row is a table header."""
     if not row:
         return False
-    return row[0].strip() and all(cell.strip() == '' for cell in row[1:])
+    if not row[0] or row[0].isspace():
+        return False
+    return all(not cell or cell.isspace() for cell in row[1:])
+
+_CFI_TITLE = "all credible fear cases"
+
+# Headers are scored by comparing their leading text with the title. Other
+# table headers in the reports ("Credible Fear Cases at ...", "All Reasonable
+# Fear Cases") score at most 86.4, while any typo of up to two edits
+# (insertions, deletions or substitutions) scores at least 91.3.
+_HEADER_MATCH_THRESHOLD = 90
+
+@lru_cache(maxsize=256)
+def _header_similarity(header):
+    """Score the start of a lowercased header against the CFI table title.
+
+    The title is compared with header prefixes a couple of characters
+    shorter and longer than itself, so typos that add or drop characters
+    still line up. Reports repeat the same table headers, so scores are
+    cached across files for the life of the process.
+    """
+    header = header.lstrip()
+    width = len(_CFI_TITLE)
+    return max(fuzz.ratio(header[:width + slack], _CFI_TITLE,
+                          score_cutoff=_HEADER_MATCH_THRESHOLD)
+               for slack in range(-2, 3))
 
 def id_all_cfi_table(rows):
     """Identify the 'All Credible Fear Cases' table."""
     for i, row in enumerate(rows):
         if is_table_header(row):
-            target = "All Credible Fear Cases"
-            similarity = fuzz.partial_ratio(row[0].lower(), target.lower())
-            if similarity > 80:
+            header = row[0].lower()
+            # Exact substring is the common case; only fall back to fuzzy
+            # matching for headers with typos or odd formatting.
+            if "all credible fear" in header:
+                return i
+            similarity = _header_similarity(header)
+            if similarity >= _HEADER_MATCH_THRESHOLD:
                 return i
     return None
 
 def convert_to_int(value):
     """Convert a string to an integer, return None if not possible."""
-    try:
-        return int(value.replace(',', '').strip())
-    except ValueError:
-        return None
+    digits = value.replace(',', '').strip()
+    # Counts are non-negative, so anything that is not all digits (blank
+    # cells, row labels, '-' placeholders) is rejected without an exception.
+    if digits.isdecimal():
+        return int(digits)
+    return None
 
 def read_csv_file(file):
-    """Read CSV file and return rows."""
-    try:
-        # Try reading with latin-1 encoding first
-        csv_reader = csv.reader(io.StringIO(file.getvalue().decode('latin-1')))
-        return [row for row in csv_reader]
-    except UnicodeDecodeError:
-        # If latin-1 fails, fall back to utf-8
-        csv_reader = csv.reader(io.StringIO(file.getvalue().decode('utf-8')))
-        return [row for row in csv_reader]
+    """Read CSV file and return a lazy iterator over its rows."""
+    raw = file.getvalue()
+    # Some reports are exported as UTF-8 with a BOM; everything else is read
+    # as latin-1, which maps every byte to a code point and cannot fail.
+    # A BOM-prefixed file can still contain stray latin-1 bytes (e.g. 0xa0),
+    # in which case it is read as latin-1 with the BOM dropped.
+    if raw.startswith(codecs.BOM_UTF8):
+        try:
+            text = raw.decode('utf-8-sig')
+        except UnicodeDecodeError:
+            text = raw[len(codecs.BOM_UTF8):].decode('latin-1')
+    else:
+        text = raw.decode('latin-1')
+    return csv.reader(io.StringIO(text))
 
 def extract_cfi_table(rows):
-    """Extract the CFI table from rows."""
+    """Extract the CFI table from rows.
+
+    Rows are consumed in a single pass, so only the table itself is kept in
+    memory: the header scan stops at the table header and collection stops
+    at the next header.
+    """
+    rows = iter(rows)
     begin_cfi = id_all_cfi_table(rows)
     if begin_cfi is None:
         print("Could not find the 'All Credible Fear Cases' table.")
         return []
-    
-    cfi_to_end = rows[begin_cfi+1:]
+
     cfi_table = []
-    for row in cfi_to_end:
+    for row in rows:
         if not is_table_header(row):
             cfi_table.append(row)
         else:
@@ -64,54 +139,62 @@ def extract_cfi_table(rows):
 
 def extract_date_ranges(cfi_table):
     """Extract date ranges from CFI table."""
-    _from = [row for row in cfi_table if row[0].strip().upper() == 'FROM'][0]
-    _to = [row for row in cfi_table if row[0].strip().upper() == 'TO'][0]
+    _from = _to = None
+    for row in cfi_table:
+        key = row[0].strip().upper()
+        if key == 'FROM' and _from is None:
+            _from = row
+        elif key == 'TO' and _to is None:
+            _to = row
+        if _from is not None and _to is not None:
+            break
+    else:
+        raise ValueError("Could not find the 'From' and 'To' date rows.")
     return [f"{start.strip()}-{end.strip()}" for start, end in zip(_from, _to)]
 
 def extract_category_data(cfi_table, categories):
     """Extract data for each category."""
-    data = defaultdict(list)
+    categories = frozenset(categories)
+    data = {}
     for row in cfi_table:
-        if row[0].strip() in categories:
-            data[row[0].strip()] = [convert_to_int(value) for value in row]
-    return data
-
-def combine_data(data, date_ranges):
-    """Combine data with date ranges."""
-    for key, value in data.items():
-        data[key] = dict(zip(date_ranges, value))
+        category = row[0].strip()
+        if category in categories:
+            data[category] = list(map(convert_to_int, row))
+            if len(data) == len(categories):
+                break
     return data
 
 def format_date(date_str):
     """Format date string."""
-    return datetime.strptime(date_str.strip(), '%m/%d/%Y').strftime('%Y-%m-%d')
+    return parse_report_date(date_str).isoformat()
 
-def reformat_data(data):
-    """Reformat the data."""
+def reformat_data(data, date_ranges):
+    """Reformat the per-category rows into one record per date range."""
     result = {}
-    for date_range in data['Case Receipts'].keys():
-        if date_range not in ['From-To', '-']:
+    columns = zip(date_ranges,
+                  data['Case Receipts'],
+                  data['All Decisions'],
+                  data['Fear Established_Persecution (Y)'],
+                  data['Fear Established_Torture (Y)'],
+                  data['Fear Not Established (N)'],
+                  data['Administratively Closed'])
+    for date_range, receipts, decisions, persecution, torture, not_established, closed in columns:
+        if date_range not in _SKIP_DATE_RANGES:
             try:
-                fear_established = data['Fear Established_Persecution (Y)'][date_range] + data['Fear Established_Torture (Y)'][date_range]
-                start_date, end_date = date_range.split('-')
+                fear_established = persecution + torture
+                match = _REPORT_DATE_RANGE.match(date_range)
+                if match is None:
+                    raise ValueError("expected M/D/YYYY-M/D/YYYY")
+                start_date, end_date = match.group(1, 2)
                 str_date_range = f"{format_date(start_date)}-{format_date(end_date)}"
-                row = {
-                    'Case Receipts': f"{data['Case Receipts'][date_range]:,}",
-                    'All Decisions': f"{data['All Decisions'][date_range]:,}",
-                    'Fear Established (Y)': f"{fear_established:,}",
-                    'Fear Not Established (N)': f"{data['Fear Not Established (N)'][date_range]:,}",
-                    'Closings': f"{data['Administratively Closed'][date_range]:,}"
-                }
-                result[str_date_range] = row
+                counts = (receipts, decisions, fear_established, not_established, closed)
+                result[str_date_range] = dict(zip(OUTPUT_COLUMNS, map(_format_count, counts)))
             except ValueError as e:
                 print(f"Error processing date range: {date_range}. Error: {str(e)}")
     return result
 
 def extract_credible_fear_data(file):
     """Extract All Credible Fear Cases data from raw government file."""
-    categories = ['Case Receipts', 'All Decisions', 'Fear Established_Persecution (Y)', 
-                  'Fear Established_Torture (Y)', 'Fear Not Established (N)', 'Administratively Closed']
-    
     rows = read_csv_file(file)
     cfi_table = extract_cfi_table(rows)
     
@@ -119,21 +202,26 @@ def extract_credible_fear_data(file):
         return {}
 
     date_ranges = extract_date_ranges(cfi_table)
-    data = extract_category_data(cfi_table, categories)
-    combined_data = combine_data(data, date_ranges)
-    result = reformat_data(combined_data)
+    data = extract_category_data(cfi_table, CATEGORIES)
+    result = reformat_data(data, date_ranges)
     
     return result
 
 def load_truth(truth_file):
-    csv_reader = csv.reader(io.StringIO(truth_file.getvalue().decode('utf-8')))
-    rows = [row for row in csv_reader]
-    row_dict = {}
-    headers = []
-    for i, row in enumerate(rows):
-        if i == 0:
-            headers = row
-        else:
-            date_range = row.pop(0)
-            row_dict[date_range] = dict(zip(headers[1:], row))
-    return row_dict
+    """Load the truth CSV into a dict keyed by its first (date range) column.
+
+    The file is read from the start regardless of its current position.
+    """
+    # Decode while reading instead of copying the whole buffer into a str;
+    # detach afterwards so the caller's file object is left open.
+    truth_file.seek(0)
+    wrapper = io.TextIOWrapper(truth_file, encoding='utf-8', newline='')
+    try:
+        csv_reader = csv.reader(wrapper)
+        headers = next(csv_reader, None)
+        if headers is None:
+            return {}
+        # zip truncates fields beyond the header, e.g. from trailing commas.
+        return {row[0]: dict(zip(headers[1:], row[1:])) for row in csv_reader if row}
+    finally:
+        wrapper.detach()